@@ -1,11 +1,35 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import csv
 import time
 import json
+import sqlite3
 import argparse
+import os
+import logging
+import shutil
+import sys
+import threading
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
+# orjson is optional; it parses and serializes JSON several times faster than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# tqdm is optional; without it progress bars are simply not shown
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+logger = logging.getLogger(__name__)
+
 # Create directories if they don't exist
 sprites_dir = Path("sprites")
 sprites_dir.mkdir(exist_ok=True)
@@ -13,185 +37,535 @@ sprites_dir.mkdir(exist_ok=True)
 # Create a cache directory
 cache_dir = Path("cache")
 cache_dir.mkdir(exist_ok=True)
-pokemon_details_dir = cache_dir / "pokemon_details"
-pokemon_details_dir.mkdir(exist_ok=True)
-evolution_chains_dir = cache_dir / "evolution_chains"
-evolution_chains_dir.mkdir(exist_ok=True)
 
 # Cache files
 POKEMON_CACHE_FILE = cache_dir / "pokemon_list.json"
 EVOLUTION_CHAINS_CACHE_FILE = cache_dir / "evolution_chains_list.json"
+CACHE_DB_FILE = cache_dir / "pokemon.db"
 
 # Cache will always be used unless force_refresh is specified
 
 # Base URL for the PokeAPI
 BASE_URL = "https://pokeapi.co/api/v2/"
 
+# Number of results to request per page of a list endpoint
+PAGE_SIZE = 200
+
+# Maximum number of requests to have in flight at once
+MAX_WORKERS = 20
+
+# Number of detail requests to queue ahead of the one being processed, per worker
+PREFETCH_PER_WORKER = 2
+
+# Maximum number of sprite downloads to have in flight at once
+SPRITE_WORKERS = 32
+
+# Size of the chunks sprite downloads are copied to disk in
+SPRITE_CHUNK_SIZE = 1 << 16
+
+# Number of CSV rows to collect before writing them out together
+CSV_BATCH_SIZE = 128
+
+# Number of rows to print as a sample of the output
+SAMPLE_ROWS = 5
+
+# Buffer size for the output CSV file, so rows reach the disk in large writes
+CSV_BUFFER_SIZE = 1 << 20
+
+# Seconds to wait for the server before giving up on a request
+REQUEST_TIMEOUT = 10
+
+# time.monotonic() value until which no new request should be sent, because the
+# server asked for a pause (or is failing) and a request is backing off
+throttle_until = 0.0
+throttle_lock = threading.Lock()
+
+def throttle_requests(delay):
+    """Hold back new requests for the next delay seconds"""
+    global throttle_until
+    # Workers call this concurrently; the lock keeps a short pause from overwriting a longer one
+    with throttle_lock:
+        throttle_until = max(throttle_until, time.monotonic() + delay)
+
+class ThrottlingRetry(Retry):
+    """Retry policy that holds back every other request while one is backing off
+    
+    Without this, the other workers would keep sending requests (and getting 429s)
+    while one of them waits out a Retry-After.
+    """
+    def sleep(self, response=None):
+        delay = self.get_retry_after(response) if response else None
+        throttle_requests(delay or self.get_backoff_time())
+        super().sleep(response)
+
+class ThrottledHTTPAdapter(HTTPAdapter):
+    """HTTP adapter that waits out any pause set by ThrottlingRetry before sending a request"""
+    def send(self, request, **kwargs):
+        delay = throttle_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return super().send(request, **kwargs)
+
+def make_http_adapter(pool_size):
+    """Build an HTTP adapter that keeps up to pool_size connections per host open for reuse"""
+    return ThrottledHTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        # Retries (with exponential backoff, honoring Retry-After) happen inside urllib3
+        max_retries=ThrottlingRetry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                                    respect_retry_after_header=True, raise_on_status=False)
+    )
+
+# Shared session so connections (and their TLS handshakes) are reused across requests.
+# The pool is sized for the largest number of requests that run at once.
+SESSION = requests.Session()
+SESSION.mount("https://", make_http_adapter(max(MAX_WORKERS, SPRITE_WORKERS)))
+# Identify the script to the API. requests already asks for compressed responses,
+# including brotli when it is installed.
+SESSION.headers["User-Agent"] = "poke_api_fetcher"
+
+def progress(iterable, quiet=False, **kwargs):
+    """Wrap an iterable in a tqdm progress bar if tqdm is installed, unless quiet is set"""
+    if tqdm and not quiet:
+        return tqdm(iterable, **kwargs)
+    return iterable
+
+def progress_print(message):
+    """Print a message without breaking up a progress bar that is being drawn"""
+    if tqdm:
+        tqdm.write(message)
+    else:
+        print(message)
+
+def json_loads(data):
+    """Parse JSON from bytes or str, using orjson if available"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(obj, indent=False):
+    """Serialize an object to JSON bytes, using orjson if available"""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+    return json.dumps(obj, indent=2 if indent else None).encode()
+
+def open_cache_db():
+    """Open the SQLite database that caches Pokemon details and evolution chains"""
+    # Autocommit mode; batches of writes are wrapped in explicit transactions
+    conn = sqlite3.connect(CACHE_DB_FILE, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # 16 MiB page cache, so the B-tree stays in memory across lookups
+    conn.execute("PRAGMA cache_size=-16384")
+    # Memory-map the database file so cache reads come straight from the page cache
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("CREATE TABLE IF NOT EXISTS pokemon_cache "
+                 "(name TEXT PRIMARY KEY, data BLOB, etag TEXT, fetched_at REAL, full INTEGER)")
+    # Caches created by older versions may be missing the newer columns
+    columns = {column[1] for column in conn.execute("PRAGMA table_info(pokemon_cache)")}
+    for column, column_type in (("etag", "TEXT"), ("fetched_at", "REAL"), ("full", "INTEGER")):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE pokemon_cache ADD COLUMN {column} {column_type}")
+    conn.execute("CREATE TABLE IF NOT EXISTS evolution_chain_cache (id TEXT PRIMARY KEY, data BLOB)")
+    return conn
+
+# Pokemon details and evolution chains are stored as the raw JSON bytes returned by the
+# API, keyed by Pokemon name and chain ID.
+# Only the main thread touches the connection; worker threads just do network I/O.
+cache_db = open_cache_db()
+
+def load_cached_json(raw_data, table, key_column, key):
+    """Parse JSON bytes stored in a cache table
+    
+    An entry that can't be parsed is deleted, so the next run fetches it again, and None is returned.
+    """
+    try:
+        return json_loads(raw_data)
+    except ValueError as e:
+        logger.warning(f"Discarding unreadable cache entry for {key}: {e}")
+        cache_db.execute(f"DELETE FROM {table} WHERE {key_column} = ?", (key,))
+        return None
+
 def is_cache_valid():
     """Check if the cache file exists"""
     return POKEMON_CACHE_FILE.exists()
 
-def save_pokemon_cache(pokemon_list):
-    """Save the Pokemon list to cache"""
+def save_pokemon_cache(pokemon_list, etag=None, last_modified=None):
+    """Save the Pokemon list to cache, along with the validators needed to revalidate it"""
     try:
-        with open(POKEMON_CACHE_FILE, 'w') as f:
-            # Save the list along with a timestamp
-            cache_data = {
-                'timestamp': datetime.now().isoformat(),
-                'pokemon_list': pokemon_list
-            }
-            json.dump(cache_data, f, indent=2)
-        print(f"Pokemon list cached to {POKEMON_CACHE_FILE}")
+        # Save the list along with a timestamp and the server's ETag/Last-Modified
+        cache_data = {
+            'timestamp': datetime.now().isoformat(),
+            'etag': etag,
+            'last_modified': last_modified,
+            'pokemon_list': pokemon_list
+        }
+        POKEMON_CACHE_FILE.write_bytes(json_dumps(cache_data, indent=True))
+        logger.info("Pokemon list cached to %s", POKEMON_CACHE_FILE)
         return True
     except Exception as e:
-        print(f"Error saving Pokemon cache: {e}")
+        logger.warning(f"Error saving Pokemon cache: {e}")
         return False
 
 def load_pokemon_cache():
-    """Load the Pokemon list from cache"""
+    """Load the cached Pokemon list data (the list plus its timestamp and validators)"""
     try:
-        with open(POKEMON_CACHE_FILE, 'r') as f:
-            cache_data = json.load(f)
-            print(f"Loaded Pokemon list from cache (created on {cache_data['timestamp']})")
-            return cache_data['pokemon_list']
+        cache_data = json_loads(POKEMON_CACHE_FILE.read_bytes())
+        logger.info("Loaded Pokemon list from cache (created on %s)", cache_data['timestamp'])
+        return cache_data
     except Exception as e:
-        print(f"Error loading Pokemon cache: {e}")
+        logger.warning(f"Error loading Pokemon cache: {e}")
         return None
 
-def fetch_pokemon_from_api():
-    """Fetch a list of all Pokemon from the API using pagination"""
-    url = f"{BASE_URL}pokemon"
-    all_pokemon = []
+def fetch_page(url):
+    """Fetch a single page of a paginated API resource"""
+    logger.info("Fetching: %s", url)
+    try:
+        response = SESSION.get(url, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        logger.warning(f"Error fetching {url}: {e}")
+        return None
+
+    if response.status_code == 200:
+        return json_loads(response.content)
+    else:
+        logger.warning(f"Failed to fetch {url}: {response.status_code}")
+        return None
+
+def fetch_all_pages(resource, count, max_workers=MAX_WORKERS):
+    """Fetch the first count entries of a list resource, requesting all pages concurrently
     
-    while url:
-        print(f"Fetching: {url}")
-        response = requests.get(url)
-        
-        if response.status_code == 200:
-            data = response.json()
-            all_pokemon.extend(data["results"])
-            url = data["next"]  # Get the URL for the next page
-            
-            # Be nice to the API - add a small delay between requests
-            time.sleep(0.1)
-        else:
-            print(f"Failed to fetch Pokemon list: {response.status_code}")
-            break
+    Returns None if any page could not be fetched.
+    """
+    urls = [f"{BASE_URL}{resource}?offset={offset}&limit={min(PAGE_SIZE, count - offset)}"
+            for offset in range(0, count, PAGE_SIZE)]
+
+    # Fetch the pages in parallel; map() keeps them in offset order
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for data in executor.map(fetch_page, urls):
+            if not data:
+                return None
+            results.extend(data["results"])
+    return results
+
+def fetch_pokemon_count_page(headers=None):
+    """Request a single-entry page of the Pokemon list, used to learn the total count"""
+    url = f"{BASE_URL}pokemon?limit=1"
+    logger.info("Fetching: %s", url)
+    return SESSION.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+
+def fetch_pokemon_from_api(count_response=None, limit=None, max_workers=MAX_WORKERS):
+    """Fetch a list of all Pokemon from the API, requesting all pages concurrently
     
-    # Save the fetched list to cache
+    count_response can be an already fetched response from fetch_pokemon_count_page.
+    With a limit, only the first limit Pokemon are fetched, and the partial list isn't cached.
+    """
+    # Ask for a single entry first to learn how many Pokemon there are
+    if count_response is None:
+        count_response = fetch_pokemon_count_page()
+    if count_response.status_code != 200:
+        logger.warning(f"Failed to fetch Pokemon list: {count_response.status_code}")
+        return []
+
+    count = json_loads(count_response.content)["count"]
+    if limit and 0 < limit < count:
+        return fetch_all_pages("pokemon", limit, max_workers) or []
+    
+    all_pokemon = fetch_all_pages("pokemon", count, max_workers)
+    if all_pokemon is None:
+        # A missing page would leave a hole in the list, so don't cache it
+        logger.warning("Failed to fetch the complete Pokemon list")
+        return []
+
+    # Save the fetched list to cache, with the validators of the count page so
+    # the next run can cheaply check whether the list has changed
     if all_pokemon:
-        save_pokemon_cache(all_pokemon)
+        save_pokemon_cache(all_pokemon,
+                           etag=count_response.headers.get('ETag'),
+                           last_modified=count_response.headers.get('Last-Modified'))
     
     return all_pokemon
 
-def get_all_pokemon():
-    """Get a list of all Pokemon, using cache if available and valid"""
+def get_all_pokemon(limit=None, max_workers=MAX_WORKERS):
+    """Get a list of all Pokemon, using cache if available and still valid
+    
+    With a limit, the list may be cut down to the first limit Pokemon when it has to be
+    fetched, so only the pages that are needed are requested.
+    """
     if is_cache_valid():
-        cached_pokemon = load_pokemon_cache()
-        if cached_pokemon:
-            return cached_pokemon
+        cache_data = load_pokemon_cache()
+        if cache_data and cache_data['pokemon_list']:
+            cached_pokemon = cache_data['pokemon_list']
+            
+            # Revalidate with a conditional request; a 304 means the cached list is current
+            headers = {}
+            if cache_data.get('etag'):
+                headers['If-None-Match'] = cache_data['etag']
+            if cache_data.get('last_modified'):
+                headers['If-Modified-Since'] = cache_data['last_modified']
+            if not headers:
+                return cached_pokemon
+            
+            try:
+                response = fetch_pokemon_count_page(headers)
+            except requests.RequestException as e:
+                logger.warning(f"Could not revalidate Pokemon list, using cache: {e}")
+                return cached_pokemon
+            
+            if response.status_code == 304:
+                logger.info("Cached Pokemon list is up to date")
+                return cached_pokemon
+            elif response.status_code == 200:
+                logger.info("Pokemon list has changed. Fetching from API...")
+                return fetch_pokemon_from_api(response, limit, max_workers) or cached_pokemon
+            else:
+                logger.warning(f"Could not revalidate Pokemon list, using cache: {response.status_code}")
+                return cached_pokemon
     
     # If cache is invalid or loading failed, fetch from API
-    print("Cache not available or invalid. Fetching from API...")
-    return fetch_pokemon_from_api()
+    logger.info("Cache not available or invalid. Fetching from API...")
+    return fetch_pokemon_from_api(limit=limit, max_workers=max_workers)
+
+def slim_pokemon_details(pokemon_data):
+    """Project Pokemon details down to the parts this script reads"""
+    slim = {key: pokemon_data.get(key) for key in ("id", "name", "height", "weight", "stats", "types")}
+    slim["sprites"] = {"front_default": pokemon_data.get("sprites", {}).get("front_default")}
+    return slim
 
-def get_pokemon_details(pokemon_url):
-    """Fetch details for a specific Pokemon, using cache if available"""
-    # Extract pokemon name from URL to use as cache key
-    pokemon_name = pokemon_url.rstrip('/').split('/')[-1]
-    cache_file = pokemon_details_dir / f"{pokemon_name}.json"
+def fetch_pokemon_details(pokemon_url, full_cache=False, etag=None):
+    """Fetch the JSON details for a specific Pokemon from the API, returning (bytes, ETag)
     
-    # Check if we have a cache for this Pokemon
-    if cache_file.exists():
-        try:
-            # Cache exists, load it
-            with open(cache_file, 'r') as f:
-                return json.load(f), True  # Return data and cache_hit=True
-        except Exception as e:
-            print(f"Error reading cache for {pokemon_name}: {e}")
+    Unless full_cache is set, the details are slimmed down with slim_pokemon_details so
+    the cache only stores (and later parses) what is needed.
     
-    # If we get here, we need to fetch from the API
-    print(f"Fetching details for {pokemon_name} from API")
-    response = requests.get(pokemon_url)
+    If etag is given the request is conditional; when the details haven't changed
+    (None, etag) is returned. On failure (None, None) is returned.
+    """
+    headers = {'If-None-Match': etag} if etag else None
+    try:
+        response = SESSION.get(pokemon_url, headers=headers, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        logger.warning(f"Error fetching Pokemon details from {pokemon_url}: {e}")
+        return None, None
     
     if response.status_code == 200:
-        pokemon_data = response.json()
-        
-        # Save to cache
+        if full_cache:
+            return response.content, response.headers.get('ETag')
         try:
-            with open(cache_file, 'w') as f:
-                json.dump(pokemon_data, f)
-        except Exception as e:
-            print(f"Error saving cache for {pokemon_name}: {e}")
-        
-        return pokemon_data, False  # Return data and cache_hit=False
+            slim = slim_pokemon_details(json_loads(response.content))
+        except (ValueError, AttributeError, TypeError) as e:
+            logger.warning(f"Invalid Pokemon details from {pokemon_url}: {e}")
+            return None, None
+        return json_dumps(slim), response.headers.get('ETag')
+    elif response.status_code == 304:
+        return None, etag
+    else:
+        logger.warning(f"Failed to fetch Pokemon details: {response.status_code}")
+        return None, None
+
+def get_pokemon_url(pokemon_name):
+    """Get the API URL for a Pokemon's details"""
+    return f"{BASE_URL}pokemon/{pokemon_name}"
+
+def preload_cache(table, key_column, keys, value_column="data"):
+    """Read many entries of a cache table at once, returning a dict of key -> JSON bytes (or value_column)"""
+    details = {}
+    # Query in chunks to stay under SQLite's limit on the number of bound parameters
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        details.update(cache_db.execute(
+            f"SELECT {key_column}, {value_column} FROM {table} WHERE {key_column} IN ({placeholders})", chunk))
+    return details
+
+def iter_pokemon_details(pokemon_list, force_refresh=False, max_workers=MAX_WORKERS, full_cache=False,
+                         revalidate=False, max_age=None):
+    """Yield (name, raw details) for every Pokemon in the list, in list order
+    
+    Cached details are read in one query, and uncached ones are fetched in parallel and
+    yielded as they arrive, so the caller can work on them while the rest are in flight.
+    Cached details are checked with a conditional request, and replaced if they have changed,
+    when revalidate is set or when they are older than max_age (a timedelta).
+    With full_cache, cached details that were slimmed down are fetched again in full.
+    The raw details are None for Pokemon that could not be fetched.
+    """
+    names = [p["name"] for p in pokemon_list]
+    if force_refresh:
+        cached = {}
     else:
-        print(f"Failed to fetch Pokemon details: {response.status_code}")
-        return None, False
+        cached = preload_cache("pokemon_cache", "name", names)
+    
+    if revalidate:
+        stale = set(cached)
+    elif max_age is not None and cached:
+        cutoff = time.time() - max_age.total_seconds()
+        fetched_at = preload_cache("pokemon_cache", "name", list(cached), value_column="fetched_at")
+        stale = {name for name, fetched in fetched_at.items() if fetched is None or fetched < cutoff}
+    else:
+        stale = set()
+    
+    # Slimmed details lack what full_cache asks for, so they are requested again without
+    # an ETag; they are still used if that request fails
+    if full_cache and cached:
+        full = preload_cache("pokemon_cache", "name", list(cached), value_column="full")
+        slim = {name for name, is_full in full.items() if not is_full}
+        stale -= slim
+    else:
+        slim = set()
+    
+    # Request uncached and stale details; stale ones are only sent again if their ETag has changed
+    etags = preload_cache("pokemon_cache", "name", list(stale), value_column="etag") if stale else {}
+    to_fetch = [(name, p) for name, p in zip(names, pokemon_list)
+                if name not in cached or name in stale or name in slim]
+    
+    if not to_fetch:
+        for name in names:
+            yield name, cached.pop(name, None)
+        return
+    
+    def fetch_one(entry):
+        name, pokemon = entry
+        return fetch_pokemon_details(pokemon["url"], full_cache, etags.get(name))
+    
+    # This runs on the caller's first next(), when its progress bar is already drawn
+    progress_print(f"Fetching details for {len(to_fetch)} Pokemon from API...")
+    fetching = {name for name, _ in to_fetch}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Keep a window of requests in flight ahead of the Pokemon being processed, rather
+        # than queueing them all, so an interrupted run doesn't wait for the whole list.
+        # Futures come off the window in to_fetch order, which is also list order.
+        entries = iter(to_fetch)
+        in_flight = deque()
+        
+        def submit_next():
+            entry = next(entries, None)
+            if entry:
+                in_flight.append(executor.submit(fetch_one, entry))
+        
+        for _ in range(max_workers * PREFETCH_PER_WORKER):
+            submit_next()
+        
+        # Store results as they arrive, all in one transaction so the writes share a single sync.
+        # Committing in finally keeps whatever was fetched if the run is interrupted.
+        cache_db.execute("BEGIN")
+        try:
+            for name in names:
+                if name not in fetching:
+                    yield name, cached.pop(name, None)
+                    continue
+                
+                raw_data, etag = in_flight.popleft().result()
+                submit_next()
+                if raw_data:
+                    cache_db.execute("INSERT OR REPLACE INTO pokemon_cache (name, data, etag, fetched_at, full) "
+                                     "VALUES (?, ?, ?, ?, ?)", (name, raw_data, etag, time.time(), full_cache))
+                elif etag and name in cached:
+                    # Not modified, so the cached details are good for another max_age
+                    cache_db.execute("UPDATE pokemon_cache SET fetched_at = ? WHERE name = ?", (time.time(), name))
+                    raw_data = cached.get(name)
+                else:
+                    # Failed, so fall back to the cached details if there are any
+                    raw_data = cached.get(name)
+                cached.pop(name, None)
+                yield name, raw_data
+        finally:
+            cache_db.execute("COMMIT")
+
+def prefetch_pokemon_details(pokemon_list, force_refresh=False, max_workers=MAX_WORKERS, full_cache=False,
+                             revalidate=False, max_age=None, quiet=False):
+    """Get the raw details for every Pokemon in the list, fetching uncached ones in parallel
+    
+    Returns a dict of Pokemon name -> JSON bytes; Pokemon that could not be fetched are missing from it.
+    """
+    details = iter_pokemon_details(pokemon_list, force_refresh, max_workers, full_cache, revalidate, max_age)
+    return {name: raw_data
+            for name, raw_data in progress(details, quiet, total=len(pokemon_list), desc="Loading", unit="pkmn")
+            if raw_data}
 
-def get_stat(pokemon_data, stat_name):
-    """Extract a specific stat from Pokemon data"""
-    for stat in pokemon_data["stats"]:
-        if stat["stat"]["name"] == stat_name:
-            return stat["base_stat"]
-    return None
+def get_stat_map(pokemon_data):
+    """Get a dict of stat name -> base stat, built once and stored on the Pokemon data"""
+    stat_map = pokemon_data.get("_stat_map")
+    if stat_map is None:
+        stat_map = {s["stat"]["name"]: s["base_stat"] for s in pokemon_data["stats"]}
+        pokemon_data["_stat_map"] = stat_map
+    return stat_map
 
 def get_types(pokemon_data):
-    """Extract types from Pokemon data"""
-    return [t["type"]["name"] for t in pokemon_data["types"]]
+    """Extract types from Pokemon data, built once and stored on the Pokemon data"""
+    types = pokemon_data.get("_types")
+    if types is None:
+        types = [t["type"]["name"] for t in pokemon_data["types"]]
+        pokemon_data["_types"] = types
+    return types
 
-def download_sprite(sprite_url, pokemon_name):
-    """Download and save a sprite image, using cached version if available"""
-    # Create a file path for the sprite
-    file_path = sprites_dir / f"{pokemon_name}.png"
+def get_sprite_path(pokemon_name):
+    """Get the local path a Pokemon's sprite is saved to"""
+    return sprites_dir.joinpath(pokemon_name + ".png")
+
+def download_sprite(sprite_url, file_path):
+    """Download and save a sprite image to file_path, using cached version if available"""
+    pokemon_name = file_path.stem
     
     # Check if the sprite already exists
     if file_path.exists():
-        print(f"Using cached sprite for {pokemon_name}")
+        logger.info("Using cached sprite for %s", pokemon_name)
         return file_path
     
     # If not, download it
-    print(f"Downloading sprite for {pokemon_name}")
-    response = requests.get(sprite_url)
-    if response.status_code == 200:
-        # Save the image
-        with open(file_path, "wb") as f:
-            f.write(response.content)
-        
-        return file_path
-    else:
-        print(f"Failed to download sprite for {pokemon_name}: {response.status_code}")
+    logger.info("Downloading sprite for %s", pokemon_name)
+    with SESSION.get(sprite_url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        if response.status_code == 200:
+            # Stream the image straight to disk instead of holding it in memory. It goes to a
+            # temporary file first so an interrupted download is never taken for a cached sprite.
+            response.raw.decode_content = True
+            tmp_path = file_path.with_suffix(".tmp")
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(response.raw, f, SPRITE_CHUNK_SIZE)
+            tmp_path.replace(file_path)
+            
+            return file_path
+        else:
+            logger.warning(f"Failed to download sprite for {pokemon_name}: {response.status_code}")
+            return None
+
+def try_download_sprite(sprite_url, file_path):
+    """Download a sprite like download_sprite, logging errors instead of raising them"""
+    try:
+        return download_sprite(sprite_url, file_path)
+    except Exception as e:
+        logger.warning(f"Error downloading sprite for {file_path.stem}: {e}")
         return None
 
-def get_pokemon_details_with_retry(pokemon_url, max_retries=3, force_refresh=False):
-    """Get Pokemon details with retry logic"""
-    retries = 0
-    while retries < max_retries:
-        try:
-            # If force_refresh is True, we'll skip the cache check in get_pokemon_details
-            if force_refresh:
-                # Extract pokemon name from URL to use as cache key
-                pokemon_name = pokemon_url.rstrip('/').split('/')[-1]
-                cache_file = pokemon_details_dir / f"{pokemon_name}.json"
-                
-                # If the cache file exists and we're forcing a refresh, remove it
-                if cache_file.exists():
-                    cache_file.unlink()
-                    print(f"Removed cache for {pokemon_name} to force refresh")
-            
-            data, from_cache = get_pokemon_details(pokemon_url)
-            return data, from_cache
-        except Exception as e:
-            retries += 1
-            print(f"Error fetching Pokemon details (attempt {retries}/{max_retries}): {e}")
-            if retries < max_retries:
-                # Exponential backoff
-                wait_time = 2 ** retries
-                print(f"Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
+def list_saved_sprites():
+    """Get the file names in the sprites directory, listed once instead of checking each file separately"""
+    return {entry.name for entry in os.scandir(sprites_dir)}
+
+def queue_sprite_downloads(executor, pending_sprites, seen_sprites):
+    """Start downloading (sprite_url, file_path) sprites on executor, skipping ones in seen_sprites
+    
+    Names are added to seen_sprites as they are queued so a sprite listed twice is only
+    downloaded once. Returns the futures of the started downloads.
+    """
+    futures = []
+    for sprite_url, file_path in pending_sprites:
+        if file_path.name not in seen_sprites:
+            seen_sprites.add(file_path.name)
+            futures.append(executor.submit(try_download_sprite, sprite_url, file_path))
+    return futures
+
+def wait_for_sprites(futures, quiet=False):
+    """Wait for queued sprite downloads to finish, logging how many failed"""
+    if not futures:
+        return
+    
+    print(f"Downloading {len(futures)} sprites...")
+    results = [future.result() for future in progress(as_completed(futures), quiet,
+                                                       total=len(futures), desc="Sprites", unit="img")]
     
-    print(f"Failed to fetch Pokemon details after {max_retries} attempts")
-    return None, False
+    failed = results.count(None)
+    if failed:
+        logger.warning(f"Failed to download {failed} sprites")
 
 def parse_arguments():
     """Parse command line arguments"""
@@ -202,6 +576,20 @@ def parse_arguments():
                         help='Limit the number of Pokemon to process (for testing)')
     parser.add_argument('--output', type=str, default="pokemon_data.csv",
                         help='Output CSV file name')
+    parser.add_argument('--max-workers', type=int, default=MAX_WORKERS,
+                        help=f'Maximum number of concurrent API requests, not counting sprite downloads '
+                             f'(default: {MAX_WORKERS})')
+    parser.add_argument('--revalidate', action='store_true',
+                        help='Check cached Pokemon details with the API and update the ones that have changed')
+    parser.add_argument('--max-age', type=float, default=None, metavar='DAYS',
+                        help='Revalidate cached Pokemon details older than this many days')
+    parser.add_argument('--full-cache', action='store_true',
+                        help='Cache the complete API response for each Pokemon instead of only the fields used, '
+                             'fetching Pokemon again that were cached without it')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Log each request, cache hit and sprite download')
+    parser.add_argument('--quiet', action='store_true',
+                        help='Do not show progress bars')
     
     # Field selection options
     field_group = parser.add_mutually_exclusive_group()
@@ -229,267 +617,183 @@ def parse_arguments():
     
     return parser.parse_args()
 
-def get_field_value(pokemon_data, field, pokemon_name, download_images=True):
-    """Get the value for a specific field from Pokemon data"""
-    if field == "name":
-        return pokemon_name
-    elif field == "id":
-        return pokemon_data.get("id")
-    elif field == "height":
-        return pokemon_data.get("height")
-    elif field == "weight":
-        return pokemon_data.get("weight")
-    elif field == "speed":
-        return get_stat(pokemon_data, "speed")
-    elif field == "attack":
-        return get_stat(pokemon_data, "attack")
-    elif field == "defense":
-        return get_stat(pokemon_data, "defense")
-    elif field == "hp":
-        return get_stat(pokemon_data, "hp")
-    elif field == "special-attack":
-        return get_stat(pokemon_data, "special-attack")
-    elif field == "special-defense":
-        return get_stat(pokemon_data, "special-defense")
-    elif field == "sprite":
-        sprite_url = pokemon_data["sprites"]["front_default"]
-        if not sprite_url:
-            return None
-        
-        if download_images:
-            # Download and return local path
-            sprite_path = download_sprite(sprite_url, pokemon_name)
-            return str(sprite_path) if sprite_path else None
-        else:
-            # Just return the URL
-            return sprite_url
-    elif field == "types":
-        return ", ".join(get_types(pokemon_data))
-    else:
-        return None
+# Stat fields, in the order the API lists them
+STAT_FIELDS = ["hp", "attack", "defense", "special-attack", "special-defense", "speed"]
 
-def main():
-    # Parse command line arguments
-    args = parse_arguments()
-    force_refresh = args.force_refresh
-    limit = args.limit
-    output_file = args.output
-    download_images = args.download_images
+# Every field that can be written to the CSV, in default column order
+ALL_FIELDS = ["name", "id", "height", "weight"] + STAT_FIELDS + ["types", "sprite"]
+
+# Extractors for every field except sprite, which needs the download options.
+# Each takes the Pokemon data and the Pokemon name.
+FIELD_HANDLERS = {
+    "name": lambda data, name: name,
+    "id": lambda data, name: data.get("id"),
+    "height": lambda data, name: data.get("height"),
+    "weight": lambda data, name: data.get("weight"),
+    "hp": lambda data, name: get_stat_map(data).get("hp"),
+    "attack": lambda data, name: get_stat_map(data).get("attack"),
+    "defense": lambda data, name: get_stat_map(data).get("defense"),
+    "special-attack": lambda data, name: get_stat_map(data).get("special-attack"),
+    "special-defense": lambda data, name: get_stat_map(data).get("special-defense"),
+    "speed": lambda data, name: get_stat_map(data).get("speed"),
+    "types": lambda data, name: ", ".join(get_types(data)),
+}
+
+def get_field_extractor(field, download_images, pending_sprites):
+    """Get a function that takes (pokemon_data, pokemon_name) and returns the value of field
     
-    # Define all available fields
-    all_available_fields = ["name", "id", "height", "weight", "hp", "attack", "defense", 
-                           "special-attack", "special-defense", "speed", "types", "sprite"]
-    all_stats_fields = ["hp", "attack", "defense", "special-attack", "special-defense", "speed"]
+    With download_images, the sprite extractor queues the download on pending_sprites and
+    returns the path the sprite will be saved to; otherwise it returns the sprite URL.
+    """
+    if field == "sprite":
+        def get_sprite(pokemon_data, pokemon_name):
+            sprite_url = pokemon_data["sprites"]["front_default"]
+            if not sprite_url:
+                return None
+            if not download_images:
+                return sprite_url
+            
+            # Queue the download and return the local path it will be saved to
+            sprite_path = get_sprite_path(pokemon_name)
+            pending_sprites.append((sprite_url, sprite_path))
+            return str(sprite_path)
+        return get_sprite
     
-    # Parse fields to fetch based on command-line options
-    if args.all_fields or not args.fields:
-        fields = all_available_fields
-    elif args.all_stats:
-        fields = ["name", "id"] + all_stats_fields + ["sprite"]
-    else:
-        fields = [f.strip() for f in args.fields.split(",")]
+    return FIELD_HANDLERS.get(field, lambda pokemon_data, pokemon_name: None)
+
+def build_row_extractor(fields, download_images, pending_sprites):
+    """Build a function that extracts the requested fields from Pokemon data
     
-    print(f"Starting Pokemon data fetcher")
-    print(f"Force refresh: {force_refresh}")
-    print(f"Fields to fetch: {', '.join(fields)}")
-    print(f"Download images: {download_images}")
-    if limit:
-        print(f"Processing limit: {limit} Pokemon")
+    The extractor for each field is looked up once here instead of per Pokemon. The
+    returned function takes (pokemon_data, pokemon_name) and returns (row, None), or
+    (None, field) for the first field other than name that has no value.
+    """
+    extractors = [(index, field, get_field_extractor(field, download_images, pending_sprites))
+                  for index, field in enumerate(fields)]
     
-    try:
-        # Create or open the CSV file
-        with open(output_file, "w", newline="") as csvfile:
-            csv_writer = csv.writer(csvfile)
-            
-            # Write the header
-            csv_writer.writerow(fields)
-            
-            # Get all Pokemon
-            print("Fetching complete Pokemon list (this may take a while)...")
-            pokemon_list = get_all_pokemon()
-            
-            # Apply limit if specified
-            if limit and limit > 0:
-                pokemon_list = pokemon_list[:limit]
-                print(f"Limited to first {limit} Pokemon")
-            
-            total_pokemon = len(pokemon_list)
-            print(f"Found {total_pokemon} Pokemon to process")
-            
-            # Process each Pokemon
-            processed = 0
-            skipped = 0
-            start_time = time.time()
-            
-            for i, pokemon in enumerate(pokemon_list):
-                pokemon_name = pokemon["name"]
-                
-                # Print progress every 10 Pokemon or for the first few
-                if i < 5 or i % 10 == 0:
-                    elapsed = time.time() - start_time
-                    if i > 0:
-                        avg_time_per_pokemon = elapsed / i
-                        est_remaining = avg_time_per_pokemon * (total_pokemon - i)
-                        est_remaining_str = f", Est. remaining: {est_remaining:.1f}s"
-                    else:
-                        est_remaining_str = ""
-                    
-                    print(f"Processing {i+1}/{total_pokemon}: {pokemon_name} "
-                          f"(Processed: {processed}, Skipped: {skipped}{est_remaining_str})")
-                
-                try:
-                    # Get Pokemon details
-                    pokemon_data, from_cache = get_pokemon_details_with_retry(pokemon["url"], force_refresh=force_refresh)
-                    if not pokemon_data:
-                        skipped += 1
-                        continue
-                    
-                    # Get values for each requested field
-                    row_data = []
-                    skip_pokemon = False
-                    
-                    for field in fields:
-                        value = get_field_value(pokemon_data, field, pokemon_name, download_images)
-                        if value is None and field != "name":  # Name should always be available
-                            print(f"No {field} data found for {pokemon_name}")
-                            skip_pokemon = True
-                            break
-                        row_data.append(value)
-                    
-                    if skip_pokemon:
-                        skipped += 1
-                        continue
-                    
-                    # Write to CSV
-                    csv_writer.writerow(row_data)
-                    processed += 1
-                    
-                except Exception as e:
-                    print(f"Error processing {pokemon_name}: {e}")
-                    skipped += 1
-                    continue
-                
-                # Be nice to the API - add a small delay between requests, but only if we actually used the API
-                if not from_cache:
-                    time.sleep(0.1)
-            
-            total_time = time.time() - start_time
-            print(f"\nDone! Processed {processed} Pokemon, skipped {skipped}.")
-            print(f"Total time: {total_time:.1f} seconds")
-            print(f"Data saved to {output_file}")
-            if download_images and any(field == "sprite" for field in fields):
-                print(f"Sprite images saved to {sprites_dir}/")
-            
-            # Print a sample of the data
-            try:
-                with open(output_file, "r") as f:
-                    sample = [next(f) for _ in range(min(6, processed + 1))]
-                    print("\nSample of the CSV data:")
-                    for line in sample:
-                        print(line.strip())
-            except Exception as e:
-                print(f"Could not read sample data: {e}")
+    # Check the cheap fields first, so a Pokemon that ends up skipped for a missing
+    # field never has its sprite queued for download
+    extractors.sort(key=lambda extractor: extractor[1] == "sprite")
     
-    except KeyboardInterrupt:
-        print("\nProcess interrupted by user")
-    except Exception as e:
-        print(f"\nError in main process: {e}")
-        import traceback
-        traceback.print_exc()
-
+    def extract_row(pokemon_data, pokemon_name):
+        row = [None] * len(fields)
+        for index, field, extract in extractors:
+            value = extract(pokemon_data, pokemon_name)
+            if value is None and field != "name":  # Name should always be available
+                return None, field
+            row[index] = value
+        return row, None
+    
+    return extract_row
 
-def fetch_evolution_chains(force_refresh=False, limit=None):
+def fetch_evolution_chains(force_refresh=False, limit=None, max_workers=MAX_WORKERS):
     """Fetch all evolution chains from the API"""
     # Check if we have a cache of evolution chains
     if EVOLUTION_CHAINS_CACHE_FILE.exists() and not force_refresh:
         try:
-            with open(EVOLUTION_CHAINS_CACHE_FILE, 'r') as f:
-                cache_data = json.load(f)
-                print(f"Loaded evolution chains from cache (created on {cache_data['timestamp']})")
-                return cache_data['evolution_chains']
+            cache_data = json_loads(EVOLUTION_CHAINS_CACHE_FILE.read_bytes())
+            logger.info("Loaded evolution chains from cache (created on %s)", cache_data['timestamp'])
+            return cache_data['evolution_chains']
         except Exception as e:
-            print(f"Error loading evolution chains cache: {e}")
+            logger.warning(f"Error loading evolution chains cache: {e}")
     
     # If we get here, we need to fetch from the API
-    print("Fetching evolution chains from API...")
-    url = f"{BASE_URL}evolution-chain"
-    all_chains = []
+    logger.info("Fetching evolution chains from API...")
+    # Ask for a single entry first to learn how many chains there are,
+    # then request every page at once instead of following "next" links
+    data = fetch_page(f"{BASE_URL}evolution-chain?limit=1")
+    if not data:
+        return []
     
-    while url:
-        print(f"Fetching: {url}")
-        response = requests.get(url)
-        
-        if response.status_code == 200:
-            data = response.json()
-            all_chains.extend(data["results"])
-            url = data.get("next")  # Get the URL for the next page
-            
-            # Apply limit if specified
-            if limit and len(all_chains) >= limit:
-                all_chains = all_chains[:limit]
-                break
-            
-            # Be nice to the API - add a small delay between requests
-            time.sleep(0.1)
-        else:
-            print(f"Failed to fetch evolution chains: {response.status_code}")
-            break
+    # Apply limit if specified
+    count = data["count"]
+    if limit:
+        count = min(count, limit)
+    
+    all_chains = fetch_all_pages("evolution-chain", count, max_workers)
+    if all_chains is None:
+        logger.warning("Failed to fetch the complete list of evolution chains")
+        return []
     
     # Save the fetched list to cache
     if all_chains:
         try:
-            with open(EVOLUTION_CHAINS_CACHE_FILE, 'w') as f:
-                # Save the list along with a timestamp
-                cache_data = {
-                    'timestamp': datetime.now().isoformat(),
-                    'evolution_chains': all_chains
-                }
-                json.dump(cache_data, f, indent=2)
-            print(f"Evolution chains cached to {EVOLUTION_CHAINS_CACHE_FILE}")
+            # Save the list along with a timestamp
+            cache_data = {
+                'timestamp': datetime.now().isoformat(),
+                'evolution_chains': all_chains
+            }
+            EVOLUTION_CHAINS_CACHE_FILE.write_bytes(json_dumps(cache_data, indent=True))
+            logger.info("Evolution chains cached to %s", EVOLUTION_CHAINS_CACHE_FILE)
         except Exception as e:
-            print(f"Error saving evolution chains cache: {e}")
+            logger.warning(f"Error saving evolution chains cache: {e}")
     
     return all_chains
 
-def get_evolution_chain_details(chain_url, force_refresh=False):
-    """Fetch details for a specific evolution chain, using cache if available"""
-    # Extract chain ID from URL to use as cache key
-    chain_id = chain_url.rstrip('/').split('/')[-1]
-    cache_file = evolution_chains_dir / f"chain_{chain_id}.json"
+def get_chain_id(chain_url):
+    """Get the ID of an evolution chain from its URL, used as its cache key"""
+    # The last path segment, ignoring a trailing slash
+    return chain_url.rstrip('/').rpartition('/')[2]
+
+def fetch_evolution_chain(chain_url):
+    """Fetch the raw JSON details for a specific evolution chain from the API"""
+    try:
+        response = SESSION.get(chain_url, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        logger.warning(f"Error fetching evolution chain details from {chain_url}: {e}")
+        return None
     
-    # Check if we have a cache for this chain
-    if cache_file.exists() and not force_refresh:
-        try:
-            # Cache exists, load it
-            with open(cache_file, 'r') as f:
-                return json.load(f), True  # Return data and cache_hit=True
-        except Exception as e:
-            print(f"Error reading cache for evolution chain {chain_id}: {e}")
+    if response.status_code == 200:
+        return response.content
+    else:
+        logger.warning(f"Failed to fetch evolution chain details: {response.status_code}")
+        return None
+
+def prefetch_evolution_chains(chains, force_refresh=False, max_workers=MAX_WORKERS, quiet=False):
+    """Get the raw details for every evolution chain in the list, fetching uncached ones in parallel
     
-    # If we get here, we need to fetch from the API
-    print(f"Fetching details for evolution chain {chain_id} from API")
-    response = requests.get(chain_url)
+    Returns a dict of chain ID -> JSON bytes; chains that could not be fetched are missing from it.
+    """
+    chain_ids = [get_chain_id(chain["url"]) for chain in chains]
+    if force_refresh:
+        details = {}
+    else:
+        details = preload_cache("evolution_chain_cache", "id", chain_ids)
+    to_fetch = [(chain_id, chain["url"]) for chain_id, chain in zip(chain_ids, chains) if chain_id not in details]
     
-    if response.status_code == 200:
-        chain_data = response.json()
-        
-        # Save to cache
+    if not to_fetch:
+        return details
+    
+    def fetch_one(entry):
+        chain_id, chain_url = entry
+        return chain_id, fetch_evolution_chain(chain_url)
+    
+    print(f"Fetching details for {len(to_fetch)} evolution chains from API...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Store results as they arrive, all in one transaction (see prefetch_pokemon_details)
+        cache_db.execute("BEGIN")
         try:
-            with open(cache_file, 'w') as f:
-                json.dump(chain_data, f)
-        except Exception as e:
-            print(f"Error saving cache for evolution chain {chain_id}: {e}")
-        
-        return chain_data, False  # Return data and cache_hit=False
-    else:
-        print(f"Failed to fetch evolution chain details: {response.status_code}")
-        return None, False
+            results = executor.map(fetch_one, to_fetch)
+            for chain_id, raw_data in progress(results, quiet, total=len(to_fetch), desc="Fetching", unit="chain"):
+                if raw_data:
+                    cache_db.execute("INSERT OR REPLACE INTO evolution_chain_cache (id, data) VALUES (?, ?)",
+                                     (chain_id, raw_data))
+                    details[chain_id] = raw_data
+        finally:
+            cache_db.execute("COMMIT")
+    
+    return details
 
 def extract_evolution_pairs(chain_data):
     """Extract all evolution pairs from an evolution chain"""
     pairs = []
+    if not chain_data or "chain" not in chain_data:
+        return pairs
     
-    def process_chain_link(chain_link, parent=None):
+    # Walk the chain with an explicit stack of (parent species, chain link)
+    stack = [(None, chain_data["chain"])]
+    while stack:
+        parent, chain_link = stack.pop()
         current_species = chain_link["species"]
         
         # If we have a parent, this is an evolution pair
@@ -499,13 +803,9 @@ def extract_evolution_pairs(chain_data):
                 "evolution": current_species
             })
         
-        # Process any further evolutions
-        for evolves_to in chain_link.get("evolves_to", []):
-            process_chain_link(evolves_to, current_species)
-    
-    # Start with the base chain link
-    if chain_data and "chain" in chain_data:
-        process_chain_link(chain_data["chain"])
+        # Push further evolutions in reverse so they're processed in their original order
+        for evolves_to in reversed(chain_link.get("evolves_to", [])):
+            stack.append((current_species, evolves_to))
     
     return pairs
 
@@ -518,18 +818,30 @@ def get_pokemon_stats(pokemon_data):
         stats[stat_name] = stat_value
     return stats
 
-def collect_evolution_data(force_refresh=False, limit=None, download_images=True, output_file="evolution_data.csv", fields=None):
+def build_row_slicer(fields, download_images, pending_sprites):
+    """Build a function that gets the values of the requested fields of one Pokemon, in field order
+    
+    Unlike build_row_extractor, missing values are kept as None rather than skipping the row.
+    """
+    extractors = [get_field_extractor(field, download_images, pending_sprites) for field in fields]
+    
+    def row_slice(pokemon_data, pokemon_name):
+        return [extract(pokemon_data, pokemon_name) for extract in extractors]
+    
+    return row_slice
+
+def collect_evolution_data(force_refresh=False, limit=None, download_images=True, output_file="evolution_data.csv", fields=None,
+                           full_cache=False, max_workers=MAX_WORKERS, revalidate=False, max_age=None, quiet=False):
     """Collect data for all evolution pairs and save to CSV"""
     print("Starting evolution data collection...")
     
     # Get all evolution chains
-    chains = fetch_evolution_chains(force_refresh, limit)
+    chains = fetch_evolution_chains(force_refresh, limit, max_workers)
     print(f"Found {len(chains)} evolution chains")
     
     # Define all available fields if not provided
     if not fields:
-        fields = ["name", "id", "height", "weight", "hp", "attack", "defense", 
-                 "special-attack", "special-defense", "speed", "types", "sprite"]
+        fields = ALL_FIELDS
     
     # Prepare CSV file fieldnames based on selected fields
     fieldnames = []
@@ -543,138 +855,144 @@ def collect_evolution_data(force_refresh=False, limit=None, download_images=True
         fieldnames.append(f"evolution_{field}")
     
     # Add stat change fields if the corresponding stats are included
-    stat_fields = ["hp", "attack", "defense", "special-attack", "special-defense", "speed"]
-    for stat in stat_fields:
-        if stat in fields:
-            fieldnames.append(f"{stat}_change")
-    
-    with open(output_file, "w", newline="") as csvfile:
-        csv_writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        csv_writer.writeheader()
-        
-        processed_chains = 0
-        processed_pairs = 0
-        skipped_pairs = 0
-        
-        for chain_info in chains:
+    active_stat_fields = [stat for stat in STAT_FIELDS if stat in fields]
+    for stat in active_stat_fields:
+        fieldnames.append(f"{stat}_change")
+    
+    # Load every chain up front, fetching the uncached ones with many requests in flight
+    chain_details = prefetch_evolution_chains(chains, force_refresh=force_refresh, max_workers=max_workers,
+                                              quiet=quiet)
+    chain_pairs = []
+    for chain_info in chains:
+        chain_id = get_chain_id(chain_info["url"])
+        raw_data = chain_details.get(chain_id)
+        if not raw_data:
+            continue
+        try:
+            chain_data = load_cached_json(raw_data, "evolution_chain_cache", "id", chain_id)
+            if chain_data:
+                chain_pairs.append(extract_evolution_pairs(chain_data))
+        except Exception as e:
+            logger.warning(f"Error processing evolution chain {chain_info['url']}: {e}")
+    
+    # Then do the same for the details of every Pokemon that appears in a pair
+    pokemon_names = dict.fromkeys(pair[side]["name"] for pairs in chain_pairs for pair in pairs
+                                  for side in ("pre_evolution", "evolution"))
+    all_details = prefetch_pokemon_details([{"name": name, "url": get_pokemon_url(name)} for name in pokemon_names],
+                                           force_refresh=force_refresh, max_workers=max_workers, full_cache=full_cache,
+                                           revalidate=revalidate, max_age=max_age, quiet=quiet)
+    
+    # Sprites are downloaded on their own pool while the pairs are being processed
+    sprite_pool = ThreadPoolExecutor(max_workers=SPRITE_WORKERS)
+    
+    try:
+        with open(output_file, "w", newline="", buffering=CSV_BUFFER_SIZE) as csvfile:
+            csv_writer = csv.writer(csvfile)
+            csv_writer.writerow(fieldnames)
+            
+            processed_chains = 0
+            processed_pairs = 0
+            skipped_pairs = 0
+            pending_sprites = []
+            sample_rows = []
+            sprite_futures = []
+            seen_sprites = list_saved_sprites()
+            row_slice = build_row_slicer(fields, download_images, pending_sprites)
+            row_batch = []
+            
+            # Pokemon details already loaded this run; a middle-stage Pokemon is in two pairs
+            details_memo = {}
+            
+            def get_details(pokemon_name):
+                if pokemon_name not in details_memo:
+                    raw_data = all_details.get(pokemon_name)
+                    details_memo[pokemon_name] = (load_cached_json(raw_data, "pokemon_cache", "name", pokemon_name)
+                                                  if raw_data else None)
+                return details_memo[pokemon_name]
+            
             try:
-                # Get chain details
-                chain_data, from_cache = get_evolution_chain_details(chain_info["url"], force_refresh)
-                if not chain_data:
-                    continue
-                
-                # Extract evolution pairs
-                pairs = extract_evolution_pairs(chain_data)
-                
-                for pair in pairs:
+                for pairs in progress(chain_pairs, quiet, desc="Chains", unit="chain"):
                     try:
-                        # Get pre-evolution details
-                        pre_evo_data, pre_from_cache = get_pokemon_details_with_retry(
-                            f"{BASE_URL}pokemon/{pair['pre_evolution']['name']}", force_refresh=force_refresh)
-                        
-                        # Get evolution details
-                        evo_data, evo_from_cache = get_pokemon_details_with_retry(
-                            f"{BASE_URL}pokemon/{pair['evolution']['name']}", force_refresh=force_refresh)
-                        
-                        if not pre_evo_data or not evo_data:
-                            skipped_pairs += 1
-                            continue
-                        
-                        # Prepare row data
-                        row_data = {}
+                        for pair in pairs:
+                            try:
+                                # Get pre-evolution details
+                                pre_evo_name = pair['pre_evolution']['name']
+                                pre_evo_data = get_details(pre_evo_name)
+                                
+                                # Get evolution details
+                                evo_name = pair['evolution']['name']
+                                evo_data = get_details(evo_name)
+                                
+                                if not pre_evo_data or not evo_data:
+                                    skipped_pairs += 1
+                                    continue
+                                
+                                # Prepare row data from the fields of both Pokemon, in fieldnames order
+                                row_data = row_slice(pre_evo_data, pre_evo_name)
+                                row_data += row_slice(evo_data, evo_name)
+                                
+                                # Calculate stat changes for included stats
+                                pre_stats = get_stat_map(pre_evo_data)
+                                evo_stats = get_stat_map(evo_data)
+                                for stat in active_stat_fields:
+                                    row_data.append((evo_stats.get(stat) or 0) - (pre_stats.get(stat) or 0))
+                                
+                                # Queue the row and write it to CSV with the rest of its batch
+                                row_batch.append(row_data)
+                                if len(row_batch) >= CSV_BATCH_SIZE:
+                                    csv_writer.writerows(row_batch)
+                                    row_batch.clear()
+                                if processed_pairs < SAMPLE_ROWS:
+                                    sample_rows.append(row_data)
+                                processed_pairs += 1
+                                
+                                # Start downloading the sprites in the background while the loop carries on
+                                if pending_sprites:
+                                    sprite_futures += queue_sprite_downloads(sprite_pool, pending_sprites, seen_sprites)
+                                    pending_sprites.clear()
+                                
+                            except Exception as e:
+                                logger.warning(f"Error processing evolution pair {pair['pre_evolution']['name']} -> {pair['evolution']['name']}: {e}")
+                                skipped_pairs += 1
+                                continue
                         
-                        # Process each field for pre-evolution
-                        for field in fields:
-                            if field == "name":
-                                row_data[f"pre_evolution_{field}"] = pair['pre_evolution']['name']
-                            elif field == "id":
-                                row_data[f"pre_evolution_{field}"] = pre_evo_data.get("id")
-                            elif field == "height":
-                                row_data[f"pre_evolution_{field}"] = pre_evo_data.get("height")
-                            elif field == "weight":
-                                row_data[f"pre_evolution_{field}"] = pre_evo_data.get("weight")
-                            elif field in ["hp", "attack", "defense", "special-attack", "special-defense", "speed"]:
-                                row_data[f"pre_evolution_{field}"] = get_stat(pre_evo_data, field)
-                            elif field == "types":
-                                row_data[f"pre_evolution_{field}"] = ", ".join(get_types(pre_evo_data))
-                            elif field == "sprite":
-                                sprite_url = pre_evo_data["sprites"]["front_default"]
-                                if not sprite_url:
-                                    row_data[f"pre_evolution_{field}"] = None
-                                elif download_images:
-                                    sprite_path = download_sprite(sprite_url, pair['pre_evolution']['name'])
-                                    row_data[f"pre_evolution_{field}"] = str(sprite_path) if sprite_path else None
-                                else:
-                                    row_data[f"pre_evolution_{field}"] = sprite_url
-                        
-                        # Process each field for evolution
-                        for field in fields:
-                            if field == "name":
-                                row_data[f"evolution_{field}"] = pair['evolution']['name']
-                            elif field == "id":
-                                row_data[f"evolution_{field}"] = evo_data.get("id")
-                            elif field == "height":
-                                row_data[f"evolution_{field}"] = evo_data.get("height")
-                            elif field == "weight":
-                                row_data[f"evolution_{field}"] = evo_data.get("weight")
-                            elif field in ["hp", "attack", "defense", "special-attack", "special-defense", "speed"]:
-                                row_data[f"evolution_{field}"] = get_stat(evo_data, field)
-                            elif field == "types":
-                                row_data[f"evolution_{field}"] = ", ".join(get_types(evo_data))
-                            elif field == "sprite":
-                                sprite_url = evo_data["sprites"]["front_default"]
-                                if not sprite_url:
-                                    row_data[f"evolution_{field}"] = None
-                                elif download_images:
-                                    sprite_path = download_sprite(sprite_url, pair['evolution']['name'])
-                                    row_data[f"evolution_{field}"] = str(sprite_path) if sprite_path else None
-                                else:
-                                    row_data[f"evolution_{field}"] = sprite_url
-                        
-                        # Calculate stat changes for included stats
-                        stat_fields = ["hp", "attack", "defense", "special-attack", "special-defense", "speed"]
-                        for stat in stat_fields:
-                            if stat in fields:
-                                pre_value = get_stat(pre_evo_data, stat) or 0
-                                evo_value = get_stat(evo_data, stat) or 0
-                                row_data[f"{stat}_change"] = evo_value - pre_value
-                        
-                        # Write to CSV
-                        csv_writer.writerow(row_data)
-                        processed_pairs += 1
-                        
-                        # Be nice to the API - add a small delay between requests, but only if we actually used the API
-                        if not pre_from_cache or not evo_from_cache:
-                            time.sleep(0.1)
+                        processed_chains += 1
                             
                     except Exception as e:
-                        print(f"Error processing evolution pair {pair['pre_evolution']['name']} -> {pair['evolution']['name']}: {e}")
-                        skipped_pairs += 1
+                        logger.warning(f"Error processing evolution chain: {e}")
                         continue
-                
-                processed_chains += 1
-                
-                # Print progress every 5 chains
-                if processed_chains % 5 == 0 or processed_chains == 1:
-                    print(f"Processed {processed_chains}/{len(chains)} chains, {processed_pairs} pairs, {skipped_pairs} skipped")
-                    
-            except Exception as e:
-                print(f"Error processing evolution chain {chain_info['url']}: {e}")
-                continue
+            finally:
+                # Write any remaining rows, even if the loop was cut short
+                csv_writer.writerows(row_batch)
+        
+            # Wait for the sprite downloads started during the loop
+            wait_for_sprites(sprite_futures, quiet)
+    finally:
+        # Drop any downloads that haven't started if the run was cut short
+        sprite_pool.shutdown(cancel_futures=True)
     
     print(f"\nDone! Processed {processed_chains} evolution chains with {processed_pairs} evolution pairs.")
     print(f"Skipped {skipped_pairs} pairs due to errors or missing data.")
     print(f"Evolution data saved to {output_file}")
     
-    # Print a sample of the data
-    try:
-        with open(output_file, "r") as f:
-            sample = [next(f) for _ in range(min(6, processed_pairs + 1))]
-            print("\nSample of the CSV data:")
-            for line in sample:
-                print(line.strip())
-    except Exception as e:
-        print(f"Could not read sample data: {e}")
+    print_csv_sample(fieldnames, sample_rows)
+
+def print_csv_sample(header, rows):
+    """Print the header and the sample rows kept while writing the CSV, formatted as in the file"""
+    print("\nSample of the CSV data:")
+    sample_writer = csv.writer(sys.stdout, lineterminator="\n")
+    sample_writer.writerow(header)
+    sample_writer.writerows(rows)
+
+def resolve_fields(args):
+    """Get the list of fields to fetch based on command-line options"""
+    # --all-fields is always set (it's the default), so check the other options first
+    if args.fields:
+        return [f.strip() for f in args.fields.split(",")]
+    elif args.all_stats:
+        return ["name", "id"] + STAT_FIELDS + ["sprite"]
+    else:
+        return ALL_FIELDS
 
 def main():
     # Parse command line arguments
@@ -683,19 +1001,20 @@ def main():
     limit = args.limit
     output_file = args.output
     download_images = args.download_images
+    max_workers = max(1, args.max_workers)
+    max_age = timedelta(days=args.max_age) if args.max_age is not None else None
+    quiet = args.quiet
     
-    # Define all available fields
-    all_available_fields = ["name", "id", "height", "weight", "hp", "attack", "defense", 
-                           "special-attack", "special-defense", "speed", "types", "sprite"]
-    all_stats_fields = ["hp", "attack", "defense", "special-attack", "special-defense", "speed"]
+    if args.verbose:
+        logger.setLevel(logging.INFO)
     
-    # Parse fields to fetch based on command-line options
-    if args.all_fields or not args.fields:
-        fields = all_available_fields
-    elif args.all_stats:
-        fields = ["name", "id"] + all_stats_fields + ["sprite"]
-    else:
-        fields = [f.strip() for f in args.fields.split(",")]
+    # Make sure every worker can keep its own connection open
+    if max_workers > max(MAX_WORKERS, SPRITE_WORKERS):
+        SESSION.mount("https://", make_http_adapter(max_workers))
+    
+    fields = resolve_fields(args)
+    field_set = frozenset(fields)
+    has_sprite = "sprite" in field_set
     
     # Check if we should collect evolution data
     if args.evolution_data:
@@ -704,7 +1023,12 @@ def main():
             limit=args.evolution_limit,
             download_images=download_images,
             output_file=args.evolution_output,
-            fields=fields  # Pass the fields parameter to collect_evolution_data
+            fields=fields,  # Pass the fields parameter to collect_evolution_data
+            full_cache=args.full_cache,
+            max_workers=max_workers,
+            revalidate=args.revalidate,
+            max_age=max_age,
+            quiet=quiet
         )
         return
     
@@ -715,9 +1039,14 @@ def main():
     if limit:
         print(f"Processing limit: {limit} Pokemon")
     
+    # Sprites are downloaded on their own pool while the Pokemon are being processed,
+    # and CSV batches are written by a single thread so they stay in order
+    sprite_pool = ThreadPoolExecutor(max_workers=SPRITE_WORKERS)
+    csv_pool = ThreadPoolExecutor(max_workers=1)
+    
     try:
         # Create or open the CSV file
-        with open(output_file, "w", newline="") as csvfile:
+        with open(output_file, "w", newline="", buffering=CSV_BUFFER_SIZE) as csvfile:
             csv_writer = csv.writer(csvfile)
             
             # Write the header
@@ -725,7 +1054,7 @@ def main():
             
             # Get all Pokemon
             print("Fetching complete Pokemon list (this may take a while)...")
-            pokemon_list = get_all_pokemon()
+            pokemon_list = get_all_pokemon(limit, max_workers)
             
             # Apply limit if specified
             if limit and limit > 0:
@@ -738,83 +1067,103 @@ def main():
             # Process each Pokemon
             processed = 0
             skipped = 0
-            start_time = time.time()
+            pending_sprites = []
+            sample_rows = []
+            sprite_futures = []
+            seen_sprites = list_saved_sprites()
+            row_batch = []
+            csv_writes = []
+            extract_row = build_row_extractor(fields, download_images, pending_sprites)
+            start_time = time.monotonic()
             
-            for i, pokemon in enumerate(pokemon_list):
-                pokemon_name = pokemon["name"]
-                
-                # Print progress every 10 Pokemon or for the first few
-                if i < 5 or i % 10 == 0:
-                    elapsed = time.time() - start_time
-                    if i > 0:
-                        avg_time_per_pokemon = elapsed / i
-                        est_remaining = avg_time_per_pokemon * (total_pokemon - i)
-                        est_remaining_str = f", Est. remaining: {est_remaining:.1f}s"
-                    else:
-                        est_remaining_str = ""
-                    
-                    print(f"Processing {i+1}/{total_pokemon}: {pokemon_name} "
-                          f"(Processed: {processed}, Skipped: {skipped}{est_remaining_str})")
-                
-                try:
-                    # Get Pokemon details
-                    pokemon_data, from_cache = get_pokemon_details_with_retry(pokemon["url"], force_refresh=force_refresh)
-                    if not pokemon_data:
-                        skipped += 1
-                        continue
-                    
-                    # Get values for each requested field
-                    row_data = []
-                    skip_pokemon = False
-                    
-                    for field in fields:
-                        value = get_field_value(pokemon_data, field, pokemon_name, download_images)
-                        if value is None and field != "name":  # Name should always be available
-                            print(f"No {field} data found for {pokemon_name}")
-                            skip_pokemon = True
-                            break
-                        row_data.append(value)
-                    
-                    if skip_pokemon:
+            # Load all cached details in one query and fetch the rest with many requests
+            # in flight, processing each Pokemon as soon as its details are available.
+            # Names come from the list itself, so if that's all we need, skip the details.
+            needs_details = bool(field_set - {"name"})
+            if needs_details:
+                all_details = iter_pokemon_details(pokemon_list, force_refresh=force_refresh,
+                                                   max_workers=max_workers, full_cache=args.full_cache,
+                                                   revalidate=args.revalidate, max_age=max_age)
+            else:
+                all_details = ((pokemon["name"], None) for pokemon in pokemon_list)
+            
+            try:
+                for pokemon_name, raw_data in progress(all_details, quiet, total=total_pokemon,
+                                                        desc="Processing", unit="pkmn"):
+                    try:
+                        # Get Pokemon details
+                        if not needs_details:
+                            pokemon_data = {}
+                        else:
+                            if not raw_data:
+                                skipped += 1
+                                continue
+                            pokemon_data = load_cached_json(raw_data, "pokemon_cache", "name", pokemon_name)
+                            if not pokemon_data:
+                                skipped += 1
+                                continue
+                        
+                        # Get values for each requested field
+                        row_data, missing_field = extract_row(pokemon_data, pokemon_name)
+                        if missing_field:
+                            logger.info("No %s data found for %s", missing_field, pokemon_name)
+                            skipped += 1
+                            continue
+                        
+                        # Queue the row and hand full batches to the writer thread
+                        row_batch.append(row_data)
+                        if len(row_batch) >= CSV_BATCH_SIZE:
+                            csv_writes.append(csv_pool.submit(csv_writer.writerows, row_batch))
+                            row_batch = []
+                        if processed < SAMPLE_ROWS:
+                            sample_rows.append(row_data)
+                        processed += 1
+                        
+                        # Start downloading the sprite in the background while the loop carries on
+                        if pending_sprites:
+                            sprite_futures += queue_sprite_downloads(sprite_pool, pending_sprites, seen_sprites)
+                            pending_sprites.clear()
+                        
+                    except Exception as e:
+                        logger.warning(f"Error processing {pokemon_name}: {e}")
                         skipped += 1
                         continue
-                    
-                    # Write to CSV
-                    csv_writer.writerow(row_data)
-                    processed += 1
-                    
-                except Exception as e:
-                    print(f"Error processing {pokemon_name}: {e}")
-                    skipped += 1
-                    continue
+            finally:
+                # Close the details generator so its cache writes are committed and its
+                # fetch pool is shut down now, even if the loop was cut short
+                all_details.close()
                 
-                # Be nice to the API - add a small delay between requests, but only if we actually used the API
-                if not from_cache:
-                    time.sleep(0.1)
+                # Write any remaining rows, wait for the writer thread to finish and
+                # flush so the file is complete on disk
+                csv_writes.append(csv_pool.submit(csv_writer.writerows, row_batch))
+                csv_pool.shutdown()
+                csvfile.flush()
+            for write in csv_writes:
+                write.result()
             
-            total_time = time.time() - start_time
+            # Wait for the sprite downloads started during the loop
+            wait_for_sprites(sprite_futures, quiet)
+            
+            total_time = time.monotonic() - start_time
             print(f"\nDone! Processed {processed} Pokemon, skipped {skipped}.")
             print(f"Total time: {total_time:.1f} seconds")
             print(f"Data saved to {output_file}")
-            if download_images and any(field == "sprite" for field in fields):
+            if download_images and has_sprite:
                 print(f"Sprite images saved to {sprites_dir}/")
             
-            # Print a sample of the data
-            try:
-                with open(output_file, "r") as f:
-                    sample = [next(f) for _ in range(min(6, processed + 1))]
-                    print("\nSample of the CSV data:")
-                    for line in sample:
-                        print(line.strip())
-            except Exception as e:
-                print(f"Could not read sample data: {e}")
+            print_csv_sample(fields, sample_rows)
     
     except KeyboardInterrupt:
         print("\nProcess interrupted by user")
     except Exception as e:
-        print(f"\nError in main process: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error in main process: {e}")
+    finally:
+        # Drop any downloads that haven't started if the run was cut short
+        sprite_pool.shutdown(cancel_futures=True)
+        csv_pool.shutdown()
 
 if __name__ == "__main__":
-    main()
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s")
+    # Close the session's pooled connections once everything is done
+    with SESSION:
+        main()